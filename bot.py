@@ -1,21 +1,42 @@
 import os
+import asyncio
+from collections import OrderedDict, defaultdict
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
 from discord import app_commands
-from transformers import MarianMTModel, MarianTokenizer
-from langdetect import detect, LangDetectException
-import nltk
-from nltk.tokenize import sent_tokenize
+import fasttext
 import json
 import re
+import sqlite3
+import hashlib
+import time
+import threading
+import urllib.request
+from dataclasses import dataclass, field
+from functools import lru_cache
+from translation_settings import LANGUAGE_CODES, NUM_BEAMS, QUALITY_NUM_BEAMS, SUPPORTED_LANGUAGES
+from inference_server import read_frame, write_frame
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
-
-# Download the punkt tokenizer before starting the bot
-nltk.download("punkt_tab")
+# UNIX socket of a running inference_server.py; translation models are loaded in-process when unset
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET')
+if not INFERENCE_SOCKET:
+    # Translation runs in this process, so load the inference runtime (torch, transformers, ctranslate2)
+    import translation
+# Ignore messages from every bot and webhook, not just vioLa itself. Off by default, so messages
+# relayed by webhooks (PluralKit, bridge bots) are still live translated
+IGNORE_BOT_MESSAGES = os.getenv('IGNORE_BOT_MESSAGES', '').lower() in ("1", "true", "yes")
+
+# Load the fastText language identification model (quantized lid.176), downloading it on first run
+LID_MODEL_PATH = os.getenv('LID_MODEL_PATH', 'lid.176.ftz')
+LID_MODEL_URL = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.ftz"
+if not os.path.exists(LID_MODEL_PATH):
+    print(f"Downloading the language identification model to {LID_MODEL_PATH}...")
+    urllib.request.urlretrieve(LID_MODEL_URL, LID_MODEL_PATH)
+lid_model = fasttext.load_model(LID_MODEL_PATH)
 
 # Load the JSON file
 with open('common_phrases_translations.json', 'r', encoding='utf-8') as file:
@@ -26,67 +47,337 @@ intents = discord.Intents.default()
 intents.message_content = True  # Enable message content intent
 bot = commands.Bot(command_prefix="!", intents=intents)
 
-# Caching for translation models
-model_cache = {}
-
-# Active live translation settings
-active_translations = {}
-error_threads = {}
-
-# Default target languages for users
-default_languages = {}
-
-def get_model_and_tokenizer(source_lang, target_lang):
-    """Retrieve the model and tokenizer from the cache or load them if not cached."""
-    global model_cache
-    model_key = f"{source_lang}-{target_lang}"
-
-    if model_key in model_cache:
-        return model_cache[model_key]
-
-    model_name = f"Helsinki-NLP/opus-mt-{source_lang}-{target_lang}"
+# Persistent cache of finished translations, keyed by a hash of (source_lang, target_lang, text)
+TRANSLATION_CACHE_PATH = os.getenv('TRANSLATION_CACHE_PATH', 'cache.db')
+TRANSLATION_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', '100000'))  # Max cached rows
+# Rows kept when pruning, leaving headroom so the cache isn't pruned again on the next miss
+TRANSLATION_CACHE_PRUNE_TO = int(TRANSLATION_CACHE_SIZE * 0.9)
+translation_db = sqlite3.connect(TRANSLATION_CACHE_PATH, check_same_thread=False)
+# The connection is shared by worker threads; one transaction at a time
+translation_db_lock = threading.Lock()
+with translation_db:
+    translation_db.execute(
+        "CREATE TABLE IF NOT EXISTS translations (key BLOB PRIMARY KEY, translation TEXT, last_used REAL)"
+    )
+    translation_db.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+    # Upper bound on the rows in the cache, so pruning only runs once it may be over the limit
+    cached_rows = translation_db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+# In-memory LRU in front of the SQLite cache for recently repeated messages
+MEMORY_CACHE_SIZE = int(os.getenv('MEMORY_CACHE_SIZE', '4096'))
+recent_translations = OrderedDict()
+
+# Pending translation requests, grouped by (source_lang, target_lang, num_beams) for batching
+pending_translations = defaultdict(list)
+batch_ready = asyncio.Event()
+# Flushes still running, referenced so the tasks aren't garbage collected mid-flight
+flush_tasks = set()
+batcher_task = None
+preload_task = None
+BATCH_INTERVAL = float(os.getenv('BATCH_INTERVAL', '0.02'))  # Seconds to wait for more requests before flushing
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '8'))  # Queued requests (one per message) decoded together
+MAX_ERROR_THREADS = 1000  # Error threads remembered for retries, oldest forgotten first
+
+@dataclass(slots=True)
+class BotState:
+    """All mutable bot state, shared by every handler."""
+    # Active live translation settings: channel id -> target language
+    active: dict[int, str] = field(default_factory=dict)
+    # Error threads awaiting a retry: message id -> thread
+    errors: dict[int, discord.Thread] = field(default_factory=dict)
+    # Original text and target language of each error thread: thread id -> (text, target language)
+    retries: dict[int, tuple[str, str]] = field(default_factory=dict)
+    # Default target languages for users: user id -> target language
+    defaults: dict[int, str] = field(default_factory=dict)
+
+    def remember_error(self, message_id, thread, text, target_lang):
+        """Track an error thread for retries, forgetting the oldest beyond MAX_ERROR_THREADS."""
+        self.errors[message_id] = thread
+        self.retries[thread.id] = (text, target_lang)
+        # dicts keep insertion order, so the first keys are the oldest
+        while len(self.errors) > MAX_ERROR_THREADS:
+            del self.errors[next(iter(self.errors))]
+        while len(self.retries) > MAX_ERROR_THREADS:
+            del self.retries[next(iter(self.retries))]
+
+state = BotState()
+bot.state = state
+
+def translation_cache_key(text, source_lang, target_lang, num_beams):
+    """Build the translation cache key; the message text itself is never stored."""
+    return hashlib.blake2b(f"{source_lang}|{target_lang}|{num_beams}|{text}".encode(), digest_size=16).digest()
+
+def lookup_cached_translations(keys):
+    """
+    Return the cached translation for each key (None when missing), marking hits as recently used.
+    A cache error counts as a miss for every key.
+    """
+    translations = []
+    try:
+        with translation_db_lock, translation_db:
+            for key in keys:
+                row = translation_db.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    translation_db.execute("UPDATE translations SET last_used = ? WHERE key = ?", (time.time(), key))
+                translations.append(row[0] if row is not None else None)
+    except sqlite3.Error as e:
+        print(f"Translation cache lookup failed: {e}")
+        return [None] * len(keys)
+    return translations
+
+def store_cached_translations(entries):
+    """
+    Cache (key, translation) pairs and evict the least recently used rows once over the size limit.
+    A cache error only skips caching, the translations are still returned to the user.
+    """
+    global cached_rows
+    now = time.time()
     try:
-        tokenizer = MarianTokenizer.from_pretrained(model_name)
-        model = MarianMTModel.from_pretrained(model_name)
-        model_cache[model_key] = (model, tokenizer)
-        print(f"Loaded and cached model for {source_lang} -> {target_lang}.")
-        return model, tokenizer
+        with translation_db_lock, translation_db:
+            translation_db.executemany(
+                "INSERT OR REPLACE INTO translations (key, translation, last_used) VALUES (?, ?, ?)",
+                [(key, translated, now) for key, translated in entries],
+            )
+            cached_rows += len(entries)
+            if cached_rows > TRANSLATION_CACHE_SIZE:
+                translation_db.execute(
+                    "DELETE FROM translations WHERE key IN "
+                    "(SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (TRANSLATION_CACHE_PRUNE_TO,),
+                )
+                cached_rows = translation_db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Translation cache store failed: {e}")
+
+def remember_translations(entries):
+    """Keep (key, translation) pairs in the in-memory LRU, dropping the oldest beyond its size."""
+    for key, translated in entries:
+        recent_translations[key] = translated
+        recent_translations.move_to_end(key)
+    while len(recent_translations) > MEMORY_CACHE_SIZE:
+        recent_translations.popitem(last=False)
+
+async def queue_translations(texts, source_lang, target_lang, num_beams=NUM_BEAMS):
+    """
+    Translate texts (e.g. the sentences of one message) as a single batcher request,
+    so they are decoded together in one generate call. Cached translations are reused.
+    """
+    keys = [translation_cache_key(text, source_lang, target_lang, num_beams) for text in texts]
+    translations = [recent_translations.get(key) for key in keys]
+    remember_translations([(key, translated) for key, translated in zip(keys, translations) if translated is not None])
+    missing = [i for i, translated in enumerate(translations) if translated is None]
+    if not missing:
+        return translations
+
+    # Fall back to the persistent cache for anything not translated recently
+    stored = await asyncio.to_thread(lookup_cached_translations, [keys[i] for i in missing])
+    remember_translations([(keys[i], translated) for i, translated in zip(missing, stored) if translated is not None])
+    for i, translated in zip(missing, stored):
+        translations[i] = translated
+    missing = [i for i in missing if translations[i] is None]
+    if not missing:
+        return translations
+
+    future = asyncio.get_running_loop().create_future()
+    batch = pending_translations[(source_lang, target_lang, num_beams)]
+    batch.append(([texts[i] for i in missing], future))
+    if len(batch) >= MAX_BATCH_SIZE:
+        batch_ready.set()
+    for i, translated in zip(missing, await future):
+        translations[i] = translated
+
+    entries = [(keys[i], translations[i]) for i in missing]
+    remember_translations(entries)
+    await asyncio.to_thread(store_cached_translations, entries)
+    return translations
+
+async def translate_text(text, source_lang, target_lang, num_beams=NUM_BEAMS):
+    """Split text into sentences, replace slang and translate them together in one batch."""
+    sentences = split_sentences(text)
+    # Most language pairs have no slang entries, skip the replacement for them entirely
+    if f"{source_lang}-{target_lang}" in SLANG_PATTERNS:
+        sentences = [replace_slang(sentence, source_lang, target_lang) for sentence in sentences]
+
+    # Sentences that are only links, mentions, emoji or symbols are kept as they are instead of decoded
+    translatable = [i for i, sentence in enumerate(sentences) if NON_TRANSLATABLE_RE.sub("", sentence).strip()]
+    if translatable:
+        translations = await queue_translations([sentences[i] for i in translatable], source_lang, target_lang, num_beams)
+        for i, translated in zip(translatable, translations):
+            sentences[i] = translated
+    return " ".join(sentences)
+
+async def inference_request(request):
+    """Send one request to the inference server and return its response."""
+    reader, writer = await asyncio.open_unix_connection(INFERENCE_SOCKET)
+    try:
+        await write_frame(writer, request)
+        response = await read_frame(reader)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+async def load_translation_model(source_lang, target_lang):
+    """Make sure the model for a language pair is loaded; returns False if it is unsupported."""
+    if INFERENCE_SOCKET:
+        response = await inference_request({"op": "load", "src": source_lang, "tgt": target_lang})
+        return response["ok"]
+    model, tokenizer = await translation.get_model_and_tokenizer(source_lang, target_lang)
+    return model is not None and tokenizer is not None
+
+async def flush_batch(source_lang, target_lang, num_beams, items):
+    """Translate one batch of queued requests and resolve their futures."""
+    try:
+        # Decode the texts of every queued request in one batch
+        texts = [text for item_texts, _ in items for text in item_texts]
+        if INFERENCE_SOCKET:
+            response = await inference_request(
+                {"op": "translate", "src": source_lang, "tgt": target_lang, "texts": texts, "beams": num_beams}
+            )
+            results = response["translations"]
+        else:
+            results = await translation.translate_batch(source_lang, target_lang, texts, num_beams)
+
+        offset = 0
+        for item_texts, future in items:
+            if not future.done():
+                future.set_result(results[offset:offset + len(item_texts)])
+            offset += len(item_texts)
     except Exception as e:
-        print(f"Error loading model {model_name}: {e}")
-        return None, None
-    
+        for _, future in items:
+            if not future.done():
+                future.set_exception(e)
+
+async def batch_translations():
+    """
+    Flush pending translation requests in one batch per language pair. Each flush runs as its own
+    task, so a slow decode or model load never holds back requests for other pairs.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(batch_ready.wait(), timeout=BATCH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        batch_ready.clear()
+
+        for key in list(pending_translations):
+            batch = pending_translations[key]
+            items = batch[:MAX_BATCH_SIZE]
+            del batch[:MAX_BATCH_SIZE]
+            if not batch:
+                del pending_translations[key]
+            task = asyncio.create_task(flush_batch(*key, items))
+            flush_tasks.add(task)
+            task.add_done_callback(flush_tasks.discard)
+
+        # Flush again straight away if a language pair still has requests waiting
+        if pending_translations:
+            batch_ready.set()
+
+# URLs, Discord markup (user/role/channel mentions, static and animated custom emoji, timestamps,
+# slash command mentions) and symbols (including emoji), stripped before deciding whether a live
+# translation message has any text worth translating
+NON_TRANSLATABLE_RE = re.compile(
+    r"(https?://\S+|<(?:[@#][!&]?\d+|a?:\w+:\d+|t:-?\d+(?::\w)?|/[^>]+)>|[^\w\s])", re.UNICODE
+)
+
+# Han, Kana and Hangul, whose one or two character words ("你好", "はい", "네") are
+# whole messages and are exempt from the short ping length check
+CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]")
+
+# Sentence boundaries: whitespace after Latin terminal punctuation, or right after CJK
+# terminal punctuation, which is written without a following space
+SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|(?<=[。！？])")
+
+def split_sentences(text):
+    """Split text into sentences for translation, dropping empty pieces."""
+    sentences = [sentence for sentence in SENTENCE_BOUNDARY_RE.split(text.strip()) if sentence.strip()]
+    return sentences or [text]
+
+class LanguageDetectionError(Exception):
+    """Raised when the language of a text cannot be detected."""
+
+def detect(text):
+    """Detect the language code of the text with fastText."""
+    # fastText predicts one line at a time
+    text = text.replace("\n", " ").strip()
+    if not text:
+        raise LanguageDetectionError("No language could be detected.")
+    # Call the C++ predictor directly: the Python wrapper's predict() builds its result with
+    # np.array(copy=False), which fails under NumPy 2. It returns (probability, label) pairs
+    predictions = lid_model.f.predict(text, 1, 0.0, "strict")
+    if not predictions:
+        raise LanguageDetectionError("No language could be detected.")
+    return predictions[0][1].replace("__label__", "")
+
+@lru_cache(maxsize=4096)
+def cached_detect(text):
+    """Detect the language code of the text, reusing results for repeated messages."""
+    language_code = detect(text)
+    # Normalize Chinese language codes
+    if language_code in ["zh-cn", "zh-tw"]:
+        language_code = "zh"
+    return language_code
+
+def compile_slang_patterns(slang_pairs):
+    """
+    Build one case-insensitive alternation of all slang phrases per language pair,
+    with a lookup of their translations by lowercased phrase.
+    """
+    patterns = {}
+    for pair, slang_dict in slang_pairs.items():
+        if not isinstance(slang_dict, dict):
+            continue
+        lookup = {slang.lower(): slang_translation for slang, slang_translation in slang_dict.items() if slang_translation}
+        if not lookup:
+            continue
+        # Longest phrases first, so a phrase wins over any shorter phrase it contains
+        alternation = "|".join(re.escape(slang) for slang in sorted(lookup, key=len, reverse=True))
+        patterns[pair] = (re.compile(alternation, re.IGNORECASE), lookup)
+    return patterns
+
+SLANG_PATTERNS = compile_slang_patterns(translations_slang)
+
+def preserve_case(original, replacement):
+    """Match the case of the replacement to the original slang."""
+    if original.isupper():
+        return replacement.upper()
+    elif original[0].isupper():
+        return replacement.capitalize()
+    else:
+        return replacement
+
 def replace_slang(message, source_lang, target_lang):
     """
     Replace slang phrases in the message based on the provided source and target languages.
     """
-    # Check if the source language exists in the translations dictionary
-    pair = f"{source_lang}-{target_lang}"
-    if pair in translations_slang:
-        slang_dict = translations_slang[pair]
-
-        # Replace slang phrases in the message (case insensitive)
-        for slang, slang_translation in slang_dict.items():
-            if slang.lower() in message.lower():
-                if slang_translation:
-                    # Use regex for case-insensitive replacement while preserving case
-                    def replace_case_insensitive(match):
-                        original = match.group(0)
-                        # Preserve the case of the original slang
-                        if original.isupper():
-                            return slang_translation.upper()
-                        elif original[0].isupper():
-                            return slang_translation.capitalize()
-                        else:
-                            return slang_translation
-
-                    # Replace all occurrences of the slang in the message
-                    message = re.sub(re.escape(slang), replace_case_insensitive, message, flags=re.IGNORECASE)
-    
+    compiled = SLANG_PATTERNS.get(f"{source_lang}-{target_lang}")
+    if compiled is None:
+        return message
+
+    # Replace every slang phrase in a single case-insensitive pass
+    pattern, lookup = compiled
+
+    def replace_match(match):
+        original = match.group(0)
+        return preserve_case(original, lookup.get(original.lower(), original))
+
+    message = pattern.sub(replace_match, message)
+
     return message
 
 @bot.event
 async def on_ready():
+    global batcher_task, preload_task
     print(f"Logged in as {bot.user}")
+    # Start the translation batcher once, on_ready can fire again after reconnects
+    if batcher_task is None:
+        batcher_task = asyncio.create_task(batch_translations())
+    # Warm up the common language pairs in the background (the inference server preloads its own)
+    if preload_task is None and not INFERENCE_SOCKET:
+        preload_task = asyncio.create_task(translation.preload_models())
     try:
         synced = await bot.tree.sync()
         print(f"Synced {len(synced)} commands")
@@ -97,86 +388,70 @@ async def on_ready():
 @bot.tree.command(name="setlanguage", description="Set your default target language.")
 async def setlanguage(interaction: discord.Interaction, target_lang: str):
     user_id = interaction.user.id
-    default_languages[user_id] = target_lang
+    if target_lang not in SUPPORTED_LANGUAGES:
+        await interaction.response.send_message(unsupported_language_message(target_lang), ephemeral=True)
+        return
+    state.defaults[user_id] = target_lang
     await interaction.response.send_message(
         f"Default target language set to: {target_lang}", ephemeral=True
     )
 
-@bot.tree.command(name="translate", description="Translate text with optional source and target languages.")
-async def translate(interaction: discord.Interaction, text: str, source_lang: str = None, target_lang: str = None):
-    """vioLa will translate a message for you."""
-    user_id = interaction.user.id
-
-    # Defer the response to allow more processing time
-    await interaction.response.defer(ephemeral=True)
-
+async def translate_for_user(
+    send, user_id, text, source_lang=None, target_lang=None, announce_detection=False, num_beams=NUM_BEAMS
+):
+    """
+    Translate text for a command and reply through send (interaction.followup.send or ctx.send).
+    """
     # Use user's default target language if no target language is provided
     if target_lang is None:
-        target_lang = default_languages.get(user_id)
+        target_lang = state.defaults.get(user_id)
         if target_lang is None:
-            await interaction.followup.send(
-                "Please set a default target language using `/setlanguage <target_lang>` or specify a target language."
-            )
+            await send("Please set a default target language using `/setlanguage <target_lang>` or specify a target language.")
+            return
+
+    # Reject unknown language codes before any model lookup
+    for language_code in (source_lang, target_lang):
+        if language_code is not None and language_code not in SUPPORTED_LANGUAGES:
+            await send(unsupported_language_message(language_code))
             return
 
     try:
         # If no source language is provided, detect it
         if source_lang is None:
-            source_lang = detect(text)
-            # Normalize Chinese language codes
-            if source_lang in ["zh-cn", "zh-tw"]:
-                source_lang = "zh"
+            source_lang = cached_detect(text)
+            if announce_detection:
+                await send(f"Detected source language: {source_lang}")
 
         # If the detected source language is the same as the target language
         if source_lang == target_lang:
-            await interaction.followup.send(
-                "The text is already in the target language."
-            )
+            await send("The text is already in the target language.")
             return
 
         # Get the model and tokenizer (using the cache)
-        model, tokenizer = get_model_and_tokenizer(source_lang, target_lang)
-        if model is None or tokenizer is None:
-            await interaction.followup.send(
-                f"Translation model for {source_lang} -> {target_lang} could not be loaded or is unsupported. Try setting a source and target language manually."
-            )
+        if not await load_translation_model(source_lang, target_lang):
+            await send(f"Translation model for {source_lang} -> {target_lang} could not be loaded or is unsupported. Try setting a source and target language manually.")
             return
 
-        # Sentence segmentation
-        sentences = sent_tokenize(text)
-        translations = []
-
-        for sentence in sentences:
-            # Replace slang in the sentence
-            updated_sentence = replace_slang(sentence, source_lang, target_lang)
-            
-            # Translate using MarianMT
-            inputs = tokenizer(updated_sentence, return_tensors="pt", padding=True)
-            translated = model.generate(**inputs)
-            translated_sentence = tokenizer.decode(translated[0], skip_special_tokens=True)
-            
-            translations.append(translated_sentence)
-
-        final_translation = " ".join(translations)
-
-        await interaction.followup.send(
-            f"Translation ({source_lang} -> {target_lang}): {final_translation}"
-        )
-    except LangDetectException:
-        await interaction.followup.send(
-            "Could not detect the language of the input text. Please try again."
-        )
+        final_translation = await translate_text(text, source_lang, target_lang, num_beams)
+
+        await send(f"Translation ({source_lang} -> {target_lang}): {final_translation}")
+    except LanguageDetectionError:
+        await send("Could not detect the language of the input text. Please try again.")
     except Exception as e:
-        await interaction.followup.send(
-            f"Error: {e}"
-        )
+        await send(f"Error: {e}")
+
+@bot.tree.command(name="translate", description="Translate text with optional source and target languages.")
+async def translate(interaction: discord.Interaction, text: str, source_lang: str = None, target_lang: str = None):
+    """vioLa will translate a message for you."""
+    # Defer the response to allow more processing time
+    await interaction.response.defer(ephemeral=True)
+    await translate_for_user(interaction.followup.send, interaction.user.id, text, source_lang, target_lang)
 
 # Slash command: /languagecodes
 @bot.tree.command(name="languagecodes", description="View all supported language codes and their corresponding languages.")
 async def languagecodes(interaction: discord.Interaction):
-    formatted_codes = format_language_codes()
     await interaction.response.send_message(
-        f"Supported Language Codes:\n{formatted_codes}",
+        f"Supported Language Codes:\n{FORMATTED_LANGUAGE_CODES}",
         ephemeral=True
     )
 
@@ -185,7 +460,10 @@ async def languagecodes(interaction: discord.Interaction):
 async def startlivetranslation(ctx, target_lang: str):
     """Start live translation mode in the current channel."""
     channel_id = ctx.channel.id
-    active_translations[channel_id] = target_lang
+    if target_lang not in SUPPORTED_LANGUAGES:
+        await ctx.send(unsupported_language_message(target_lang))
+        return
+    state.active[channel_id] = target_lang
     await ctx.send(f"Live translation mode activated. Messages will be translated to {target_lang}.")
 
 # Command: Stop live translation
@@ -193,8 +471,8 @@ async def startlivetranslation(ctx, target_lang: str):
 async def stoplivetranslation(ctx):
     """Stop live translation mode in the current channel."""
     channel_id = ctx.channel.id
-    if channel_id in active_translations:
-        del active_translations[channel_id]
+    if channel_id in state.active:
+        del state.active[channel_id]
         await ctx.send("Live translation mode deactivated.")
     else:
         await ctx.send("Live translation mode is not active in this channel.")
@@ -202,8 +480,9 @@ async def stoplivetranslation(ctx):
 @bot.event
 async def on_message(message):
     """Listen for messages and translate them in live translation mode."""
-    # Skip if the message is from the bot
-    if message.author == bot.user:
+    # Skip the bot's own messages, so translations are never translated again, messages from
+    # other bots when IGNORE_BOT_MESSAGES is set, and messages without text (attachments or embeds only)
+    if message.author == bot.user or (IGNORE_BOT_MESSAGES and message.author.bot) or not message.content:
         return
 
     # Process bot commands first
@@ -211,93 +490,87 @@ async def on_message(message):
         await bot.process_commands(message)
         return
 
+    # Most messages are outside threads in channels without live translation, nothing to do for them
+    is_thread = isinstance(message.channel, discord.Thread)
+    if not is_thread and message.channel.id not in state.active:
+        return
+
     # Check if the message is in a thread
-    if isinstance(message.channel, discord.Thread):
+    if is_thread:
         if message.channel.name.startswith("Translation:") or message.channel.name.startswith("Error: Translation model for"):
             if len(message.content) == 2:  # Language codes are typically 2 characters
                 retry_language_code = message.content.lower()
                 try:
-                    async for thread_message in message.channel.history(limit=2, oldest_first=True):
-                        if "Translating: " in thread_message.content:
-                            first_message = thread_message.content.split("Translating: ")[1]
-                    async for thread_message in message.channel.history(limit=3, oldest_first=True):
-                        if "Translation model for" in thread_message.content:
-                            target_lang = thread_message.content.split("->")[-1].strip().split()[0]
-                            await retry_translation(
-                                thread=message.channel,
-                                original_message=first_message,
-                                retry_language_code=retry_language_code,
-                                target_lang=target_lang,
-                            )
-                            return
+                    retry = state.retries.get(message.channel.id)
+                    if retry is None:
+                        # Threads from before a restart: find the original text and the error message in the history
+                        first_message = None
+                        error_line = None
+                        async for thread_message in message.channel.history(limit=3, oldest_first=True):
+                            if "Translating: " in thread_message.content:
+                                first_message = thread_message.content.split("Translating: ", 1)[1]
+                            elif "Translation model for" in thread_message.content:
+                                error_line = thread_message.content
+                        if error_line is not None:
+                            retry = (first_message, error_line.split("->")[-1].strip().split()[0])
+                    if retry is not None:
+                        first_message, target_lang = retry
+                        await retry_translation(
+                            thread=message.channel,
+                            original_message=first_message,
+                            retry_language_code=retry_language_code,
+                            target_lang=target_lang,
+                        )
+                        return
                 except Exception as e:
                     await message.channel.send(f"Error handling retry: {e}")
                     return
 
     # Check if live translation is active for the channel
-    channel_id = message.channel.id
-    if channel_id in active_translations:
-        target_lang = active_translations[channel_id]
+    target_lang = state.active.get(message.channel.id)
+    if target_lang is not None:
+
+        # Skip messages with nothing to translate (links, mentions, emoji, short pings)
+        text = NON_TRANSLATABLE_RE.sub("", message.content).strip()
+        if not text or (len(text) < 3 and not CJK_RE.search(text)):
+            return
 
         try:
-            source_lang = detect(message.content)
-            # Normalize Chinese language codes
-            if source_lang in ["zh-cn", "zh-tw"]:
-                source_lang = "zh"
+            source_lang = cached_detect(message.content)
             if source_lang == target_lang:
                 return
 
-            model, tokenizer = get_model_and_tokenizer(source_lang, target_lang)
-            if model is None or tokenizer is None:
+            if not await load_translation_model(source_lang, target_lang):
                 error_msg = f"Translation model for {source_lang} -> {target_lang} could not be loaded or is unsupported."
                 error_thread = await message.create_thread(name=f"Error: {error_msg}")
                 await error_thread.send(f"Translating: {message.content}")
                 await error_thread.send(f"{error_msg}\n\nReply to this message with a new source language (e.g., 'en').")
-                error_threads[message.id] = error_thread
+                state.remember_error(message.id, error_thread, message.content, target_lang)
                 return
 
-            # Sentence segmentation and translation
-            sentences = sent_tokenize(message.content)
-            translations = []
-
-            for sentence in sentences:
-                # Replace slang in the sentence
-                updated_sentence = replace_slang(sentence, source_lang, target_lang)
-                
-                # Translate using MarianMT
-                inputs = tokenizer(updated_sentence, return_tensors="pt", padding=True)
-                translated = model.generate(**inputs)
-                translated_sentence = tokenizer.decode(translated[0], skip_special_tokens=True)
-                
-                translations.append(translated_sentence)
-
-            final_translation = " ".join(translations)
+            final_translation = await translate_text(message.content, source_lang, target_lang)
 
             # Create a thread for the translation
             thread_title = f"Translation: {source_lang} -> {target_lang}"
             translation_thread = await message.create_thread(name=thread_title, auto_archive_duration=60)
 
-            # Ensure the bot is explicitly added as a thread member
-            await translation_thread.add_user(bot.user)
-
-            # Iterate over the list of thread members and remove all non-bot users
-            for member in translation_thread.members:
-                if member.id != bot.user.id:  # Skip the bot itself
-                    try:
-                        await translation_thread.remove_user(member)
-                    except Exception as e:
-                        print(f"Failed to remove {member.name} from thread: {e}")
+            # The bot joins the thread by creating it; remove any other members concurrently
+            # (usually none, so no requests are made)
+            members = [member for member in translation_thread.members if member.id != bot.user.id]
+            results = await asyncio.gather(
+                *[translation_thread.remove_user(member) for member in members], return_exceptions=True
+            )
+            for member, result in zip(members, results):
+                if isinstance(result, Exception):
+                    print(f"Failed to remove {member.name} from thread: {result}")
 
             await translation_thread.send(f"Translated message: {final_translation}")
 
-        except LangDetectException:
+        except LanguageDetectionError:
             await message.channel.send("Could not detect the language of the input text. Skipping.")
         except Exception as e:
             await message.channel.send(f"Error during translation: {e}")
 
-    # Ensure other bot commands are processed
-    await bot.process_commands(message)
-
 # Retry translation in error threads
 async def retry_translation(thread, original_message, retry_language_code, target_lang):
     """
@@ -311,14 +584,12 @@ async def retry_translation(thread, original_message, retry_language_code, targe
             return
 
         # Load the new model
-        model_name = f"Helsinki-NLP/opus-mt-{retry_language_code}-{target_lang}"
-        tokenizer = MarianTokenizer.from_pretrained(model_name)
-        model = MarianMTModel.from_pretrained(model_name)
+        if not await load_translation_model(retry_language_code, target_lang):
+            await thread.send(f"Translation model for {retry_language_code} -> {target_lang} could not be loaded or is unsupported.")
+            return
 
         # Perform the translation
-        inputs = tokenizer(text_to_translate, return_tensors="pt", padding=True)
-        translated = model.generate(**inputs)
-        translation = tokenizer.decode(translated[0], skip_special_tokens=True)
+        translation = await translate_text(text_to_translate, retry_language_code, target_lang)
 
         # Rename the thread to include the updated source and target languages
         new_thread_name = f"Translation: {retry_language_code} -> {target_lang}"
@@ -332,48 +603,36 @@ async def retry_translation(thread, original_message, retry_language_code, targe
 @bot.event
 async def on_message_edit(before, after):
     """Handle editing of messages and retry translation if necessary."""
-    if after.id in error_threads:
-        error_thread = error_threads[after.id]
+    if after.id in state.errors:
+        error_thread = state.errors[after.id]
         # Check if the edited message is a valid retry attempt
         if after.content:
             try:
                 # Retry translation
-                source_lang = detect(after.content)
-                # Normalize Chinese language codes
-                if source_lang in ["zh-cn", "zh-tw"]:
-                    source_lang = "zh"
-                target_lang = active_translations.get(after.channel.id, None)
+                source_lang = cached_detect(after.content)
+                target_lang = state.active.get(after.channel.id, None)
                 if target_lang:
-                    model, tokenizer = get_model_and_tokenizer(source_lang, target_lang)
-                    if model is None or tokenizer is None:
+                    if not await load_translation_model(source_lang, target_lang):
                         await error_thread.send(f"Model for {source_lang} -> {target_lang} could not be loaded or is unsupported. Try setting a source and target language manually.")
                         return
 
                     # Translate and send the result
-                    inputs = tokenizer(after.content, return_tensors="pt", padding=True)
-                    translated = model.generate(**inputs)
-                    translation = tokenizer.decode(translated[0], skip_special_tokens=True)
+                    translation = await translate_text(after.content, source_lang, target_lang)
                     await error_thread.send(f"Translated message: {translation}")
                     # Remove the error thread as the retry succeeded
-                    del error_threads[after.id]
+                    del state.errors[after.id]
             except Exception as e:
                 await error_thread.send(f"Error retrying translation: {e}")
 
-@bot.command()
-async def translate(ctx, source_lang: str = None, target_lang: str = None, *, text: str = None):
-    """Translate a message with optional source and target languages."""
-    user_id = ctx.author.id
-
-    # Use user's default target language if no target language is provided
-    if target_lang is None:
-        target_lang = default_languages.get(user_id)
-        if target_lang is None:
-            await ctx.send("Please set a default target language using /setlanguage <target_lang> or specify a target language in the command.")
-            return
-
+async def translate_message_command(ctx, source_lang, target_lang, text, num_beams):
+    """Shared body of the prefix translate commands, which can also translate the message replied to."""
     # If the command is a reply, get the original message
-    if ctx.message.reference is not None:
-        original_message = await ctx.channel.fetch_message(ctx.message.reference.message_id)
+    reference = ctx.message.reference
+    if reference is not None:
+        # discord.py usually resolves the replied-to message already, only fetch it when it didn't
+        original_message = reference.resolved
+        if not isinstance(original_message, discord.Message):
+            original_message = await ctx.channel.fetch_message(reference.message_id)
         text = original_message.content  # Use the original message's content
 
     # If text is still None, inform the user
@@ -381,130 +640,73 @@ async def translate(ctx, source_lang: str = None, target_lang: str = None, *, te
         await ctx.send("Please provide text to translate or reply to a message.")
         return
 
-    try:
-        # If no source language is provided, detect it
-        if source_lang is None:
-            source_lang = detect(text)
-            # Normalize Chinese language codes
-            if source_lang in ["zh-cn", "zh-tw"]:
-                source_lang = "zh"
-            await ctx.send(f"Detected source language: {source_lang}")
-
-        # If the detected source language is the same as the target language
-        if source_lang == target_lang:
-            await ctx.send("The text is already in the target language.")
-            return
-
-        # Get the model and tokenizer (using the cache)
-        model, tokenizer = get_model_and_tokenizer(source_lang, target_lang)
-        if model is None or tokenizer is None:
-            await ctx.send(f"Translation model for {source_lang} -> {target_lang} could not be loaded or is unsupported. Try setting a source and target language manually.")
-            return
+    await translate_for_user(
+        ctx.send, ctx.author.id, text, source_lang, target_lang, announce_detection=True, num_beams=num_beams
+    )
 
-        # Sentence segmentation
-        sentences = sent_tokenize(text)
-        translations = []
-
-        for sentence in sentences:
-            # Replace slang in the sentence
-            updated_sentence = replace_slang(sentence, source_lang, target_lang)
-            
-            # Translate using MarianMT
-            inputs = tokenizer(updated_sentence, return_tensors="pt", padding=True)
-            translated = model.generate(**inputs)
-            translated_sentence = tokenizer.decode(translated[0], skip_special_tokens=True)
-            
-            translations.append(translated_sentence)
-
-        final_translation = " ".join(translations)
-
-        await ctx.send(f"Translation ({source_lang} -> {target_lang}): {final_translation}")
-    except LangDetectException:
-        await ctx.send("Could not detect the language of the input text. Please try again.")
-    except Exception as e:
-        await ctx.send(f"Error: {e}")
+@bot.command(name="translate")
+async def translate_command(ctx, source_lang: str = None, target_lang: str = None, *, text: str = None):
+    """Translate a message with optional source and target languages."""
+    await translate_message_command(ctx, source_lang, target_lang, text, NUM_BEAMS)
+
+@bot.command(name="tquality")
+async def tquality_command(ctx, source_lang: str = None, target_lang: str = None, *, text: str = None):
+    """Translate a message with beam search, slower but more accurate than !translate."""
+    await translate_message_command(ctx, source_lang, target_lang, text, QUALITY_NUM_BEAMS)
+
+def format_slang_terms(slang_pairs):
+    """Format the slang term listing of every source language code once."""
+    responses = {}
+    found = set()
+    for pair, slang_dict in slang_pairs.items():
+        source, target = pair.split("-")
+        response = responses.get(source, f"**Slang terms for `{source}`:**\n")
+        if isinstance(slang_dict, dict):  # Check if it's a dictionary
+            for slang, target_slang in slang_dict.items():
+                response += f"`[{slang}] -> [{target}]: {target_slang}`\n"
+            found.add(source)
+        else:
+            response += f"\nError: Unexpected structure for key `{pair}`. Value: {slang_dict}"
+            print(f"Debug: slang_dict is not a dictionary for key `{pair}`. Value: {slang_dict}")
+        responses[source] = response
+    # Only listings with at least one valid pair are shown, as before
+    return {source: response for source, response in responses.items() if source in found}
+
+# Precompute the slang term listings, the slang data doesn't change while the bot runs
+FORMATTED_SLANG_TERMS = format_slang_terms(translations_slang)
+
+def slang_terms_message(language_code):
+    """Build the reply for the slangterms commands."""
+    return FORMATTED_SLANG_TERMS.get(
+        language_code, f"No slang terms found for the language code: `{language_code}`."
+    )
 
 @bot.tree.command(name="slangterms", description="Show all supported slang terms for a specific language code.")
 async def slangterms(interaction: discord.Interaction, language_code: str):
     """Display all slang terms for a specified language code privately."""
-    found = False
-    response = f"**Slang terms for `{language_code}`:**\n"
-
-    for pair, slang_dict in translations_slang.items():
-        source, target = pair.split("-")
-        if source == language_code:
-            if isinstance(slang_dict, dict):  # Check if it's a dictionary
-                for slang, target_slang in slang_dict.items():
-                    response += f"`[{slang}] -> [{target}]: {target_slang}`\n"
-                found = True
-            else:
-                response += f"\nError: Unexpected structure for key `{pair}`. Value: {slang_dict}"
-                print(f"Debug: slang_dict is not a dictionary for key `{pair}`. Value: {slang_dict}")
-    
-    if not found:
-        response = f"No slang terms found for the language code: `{language_code}`."
-
-    await interaction.response.send_message(response, ephemeral=True)
+    await interaction.response.send_message(slang_terms_message(language_code), ephemeral=True)
 
 
 @bot.command(name="slangterms")
 async def slangterms_command(ctx, language_code: str):
     """Display all slang terms for a specified language code publicly."""
-    found = False
-    response = f"**Slang terms for `{language_code}`:**\n"
-
-    for pair, slang_dict in translations_slang.items():
-        source, target = pair.split("-")
-        if source == language_code:
-            if isinstance(slang_dict, dict):  # Check if it's a dictionary
-                for slang, target_slang in slang_dict.items():
-                    response += f"`[{slang}] -> [{target}]: {target_slang}`\n"
-                found = True
-            else:
-                response += f"\nError: Unexpected structure for key `{pair}`. Value: {slang_dict}"
-                print(f"Debug: slang_dict is not a dictionary for key `{pair}`. Value: {slang_dict}")
-    
-    if not found:
-        response = f"No slang terms found for the language code: `{language_code}`."
-
-    await ctx.send(response)
-
-# List of supported language codes and their respective languages for MarianMT
-LANGUAGE_CODES = {
-    "en": "English",
-    "fr": "French",
-    "de": "German",
-    "es": "Spanish",
-    "it": "Italian",
-    "ru": "Russian",
-    "zh": "Chinese (Simplified)",
-    "ja": "Japanese",
-    "ko": "Korean",
-    "ar": "Arabic",
-    "pt": "Portuguese",
-    "nl": "Dutch",
-    "sv": "Swedish",
-    "pl": "Polish",
-    "fi": "Finnish",
-    "tr": "Turkish",
-    "cs": "Czech",
-    "hu": "Hungarian",
-    "ro": "Romanian",
-    "tl": "Tagalog",
-    "th": "Thai",
-    "id": "Indonesian",
-    "hi": "Hindi",
-}
+    await ctx.send(slang_terms_message(language_code))
 
 def format_language_codes():
     """Format the language codes into a readable string."""
     return "\n".join([f"`{code}`: {language}" for code, language in LANGUAGE_CODES.items()])
 
+# The language codes never change, so format them once
+FORMATTED_LANGUAGE_CODES = format_language_codes()
+
+def unsupported_language_message(language_code):
+    """Build the reply for a language code that isn't in LANGUAGE_CODES."""
+    return f"Unsupported language code: `{language_code}`. Use `languagecodes` to see the supported codes."
+
 # Bot command: !languagecodes
 @bot.command(name="languagecodes")
 async def languagecodes_command(ctx):
-    formatted_codes = format_language_codes()
-    await ctx.send(f"Supported Language Codes:\n{formatted_codes}")
+    await ctx.send(f"Supported Language Codes:\n{FORMATTED_LANGUAGE_CODES}")
 
 # Help message content
 HELP_MESSAGE = """
@@ -520,11 +722,12 @@ HELP_MESSAGE = """
 6. `/about`: Learn more about vioLa!
 ### **Bot Commands (outputs to the whole server!):**
 1. `!translate <text> [source_lang] [target_lang]`: Same thing as above, but publicly! Reply to a message without the `<text>` to translate that message.
-2. `!startlivetranslation <target_lang>`: Start live translation mode in the current channel. Messages will be translated to the specified target language.
-3. `!stoplivetranslation`: Stop live translation mode in the current channel.
-4. `!languagecodes`: View all supported language codes and their corresponding languages publicly.
-5. `!slangterms <language_code>`: Show all supported slang terms for a specific language code publicly.
-6. `!help`: Display this help message publicly.
+2. `!tquality <text> [source_lang] [target_lang]`: Like `!translate`, but slower and more accurate.
+3. `!startlivetranslation <target_lang>`: Start live translation mode in the current channel. Messages will be translated to the specified target language.
+4. `!stoplivetranslation`: Stop live translation mode in the current channel.
+5. `!languagecodes`: View all supported language codes and their corresponding languages publicly.
+6. `!slangterms <language_code>`: Show all supported slang terms for a specific language code publicly.
+7. `!help`: Display this help message publicly.
 ### **Live Translation:**
 - When live translation is active, I will listen into the conversation and translate it to the specified language.
 - If you run into an error, you can retry with the correct source language by replying to the thread!
@@ -543,9 +746,9 @@ Here's some important information about how I work:
 ### **Privacy:**
 Here's how I handle your data:
 - **Data Handling**:  
-  I process your messages temporarily in memory for translation purposes. I do not store or permanently save your messages.
+  I process your messages temporarily in memory for translation purposes. To speed up repeated translations, I save the translated text of your messages to a cache on my host's disk, looked up by a one-way hash of the original message. The original text isn't saved, but the translation carries its content and stays in that cache until it is pushed out by newer translations.
 - **Sensitive Content**:  
-  Please don't share sensitive, confidential, or personally identifiable information. While I don't store data, your messages are processed in memory and could potentially appear in error logs.
+  Please don't share sensitive, confidential, or personally identifiable information. Translations of your messages are kept in my translation cache, and your messages could potentially appear in error logs.
 - **Message Visibility**:  
   My translations and responses are visible in the channel or thread where they're posted unless explicitly set to be private (e.g., using slash commands). Use private commands for sensitive content.
 ### **Disclaimers:**
@@ -0,0 +1,81 @@
+"""
+Standalone translation inference server for vioLa.
+
+Owns the translation models in its own process, so a crash or a slow model load doesn't take
+the Discord connection down with it. The bot talks to it over a UNIX domain socket when
+INFERENCE_SOCKET is set. Start it with `python inference_server.py` before starting the bot.
+
+Every request and response is a msgpack map, framed with a 4-byte big-endian length prefix:
+- {"op": "load", "src": ..., "tgt": ...} loads a language pair.
+- {"op": "translate", "src": ..., "tgt": ..., "texts": [...], "beams": ...} translates a batch of texts;
+  "beams" is optional and defaults to NUM_BEAMS.
+Responses are {"ok": True, ...} or {"ok": False, "error": "..."}.
+"""
+import os
+import asyncio
+import msgpack
+from dotenv import load_dotenv
+from translation_settings import NUM_BEAMS
+
+# Load environment variables
+load_dotenv()
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET', '/tmp/viola.sock')
+# Model preloading running in the background, referenced so the task isn't garbage collected mid-flight
+preload_task = None
+
+async def read_frame(reader):
+    """Read one length-prefixed msgpack message."""
+    header = await reader.readexactly(4)
+    payload = await reader.readexactly(int.from_bytes(header, "big"))
+    return msgpack.unpackb(payload)
+
+async def write_frame(writer, message):
+    """Write one length-prefixed msgpack message."""
+    payload = msgpack.packb(message)
+    writer.write(len(payload).to_bytes(4, "big") + payload)
+    await writer.drain()
+
+async def handle_request(request):
+    """Run a single load or translate request against the local model cache."""
+    from translation import get_model_and_tokenizer, translate_batch
+
+    try:
+        source_lang, target_lang = request["src"], request["tgt"]
+        if request["op"] == "load":
+            model, tokenizer = await get_model_and_tokenizer(source_lang, target_lang)
+            return {"ok": model is not None and tokenizer is not None}
+        if request["op"] == "translate":
+            num_beams = request.get("beams", NUM_BEAMS)
+            translations = await translate_batch(source_lang, target_lang, request["texts"], num_beams)
+            return {"ok": True, "translations": translations}
+        return {"ok": False, "error": f"Unknown request: {request['op']}"}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+async def handle_connection(reader, writer):
+    """Serve requests from one bot connection until it closes."""
+    try:
+        while True:
+            try:
+                request = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                break
+            await write_frame(writer, await handle_request(request))
+    finally:
+        writer.close()
+
+async def main():
+    global preload_task
+    from translation import preload_models
+
+    # Remove a socket left behind by a previous run
+    if os.path.exists(INFERENCE_SOCKET):
+        os.remove(INFERENCE_SOCKET)
+    server = await asyncio.start_unix_server(handle_connection, path=INFERENCE_SOCKET)
+    print(f"Inference server listening on {INFERENCE_SOCKET}")
+    preload_task = asyncio.create_task(preload_models())
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(main())
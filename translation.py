@@ -0,0 +1,395 @@
+"""
+Translation model loading and inference for vioLa, shared by the bot and inference_server.py.
+"""
+import os
+import asyncio
+import gc
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, defaultdict
+from dotenv import load_dotenv
+from transformers import AutoTokenizer, MarianMTModel, MarianTokenizer
+import ctranslate2
+import torch
+from translation_settings import BEAM_LENGTH_PENALTY, NUM_BEAMS, SUPPORTED_LANGUAGES
+
+# Load environment variables
+load_dotenv()
+
+# Leave cores for the event loop and avoid oversubscription when translation threads overlap
+torch.set_num_threads(max(1, os.cpu_count() - 2))
+torch.set_num_interop_threads(1)
+
+# Run on the GPU in half precision when one is available
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Precision of the transformers and onnxruntime backends on the CPU: "int8" (dynamic quantization),
+# "bf16" (for CPUs with AVX512_BF16 or AMX; fp32 on onnxruntime) or "fp32"
+CPU_PRECISION = os.getenv('CPU_PRECISION', 'int8')
+if DEVICE == "cuda":
+    DTYPE = torch.float16
+elif CPU_PRECISION == "bf16":
+    DTYPE = torch.bfloat16
+else:
+    DTYPE = torch.float32
+# Allow TF32 matmuls on Ampere and newer GPUs
+torch.set_float32_matmul_precision('high')
+
+# Inference backend for the translation models: "ctranslate2", "onnxruntime" or "transformers"
+TRANSLATION_BACKEND = os.getenv('TRANSLATION_BACKEND', 'ctranslate2')
+
+# Directory holding the CTranslate2 (int8) conversions of the Helsinki-NLP models
+CT2_MODEL_DIR = os.getenv('CT2_MODEL_DIR', 'models')
+
+# Directory holding the quantized ONNX exports of the Helsinki-NLP models
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', 'onnx_models')
+
+# Decoding settings applied to every model's generation config: no sampling, with the KV cache,
+# and no n-gram blocking (a per-step Python logits processor that translation doesn't need)
+GEN_KW = dict(num_beams=NUM_BEAMS, do_sample=False, use_cache=True, no_repeat_ngram_size=0)
+if NUM_BEAMS > 1:
+    # Only meaningful for beam search, transformers warns about it otherwise
+    GEN_KW["early_stopping"] = True
+
+# Max translation models kept in memory, enough to keep PRELOAD_PAIRS resident
+MAX_CACHED_MODELS = int(os.getenv('MAX_CACHED_MODELS', '12'))
+
+# Dedicated threads for model loads and decodes, kept apart from the default executor
+# so cache lookups never queue behind a long translation
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '2'))
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+# Reusable input tensors for generate(); Discord messages are bounded in length,
+# so one fixed-size buffer pair per worker thread covers every chunk of BUFFER_BATCH_SIZE texts
+MAX_INPUT_LENGTH = 512
+BUFFER_BATCH_SIZE = 8
+input_buffers = queue.LifoQueue()
+
+# Caching for translation models, least recently used first
+model_cache = OrderedDict()
+# Tokenizers are small, so they outlive evicted models
+tokenizer_cache = {}
+
+# Per language pair locks that serialize model loads
+load_locks = defaultdict(asyncio.Lock)
+
+# Most used language pairs, loaded at startup instead of on their first message.
+# Override with a comma separated list such as PRELOAD_PAIRS=en-fr,fr-en (empty to disable)
+DEFAULT_PRELOAD_PAIRS = "en-fr,fr-en,en-de,de-en,en-es,es-en,en-ru,ru-en,en-zh,zh-en,ja-en"
+PRELOAD_PAIRS = [
+    tuple(pair.strip().split("-", 1))
+    for pair in os.getenv('PRELOAD_PAIRS', DEFAULT_PRELOAD_PAIRS).split(",")
+    if "-" in pair
+]
+
+def from_pretrained_offline_first(loader, model_name, **kwargs):
+    """Load from the local Hugging Face cache, only going to the Hub when the files are missing."""
+    try:
+        return loader.from_pretrained(model_name, local_files_only=True, **kwargs)
+    except OSError:
+        return loader.from_pretrained(model_name, **kwargs)
+
+def load_ctranslate2_model(model_name, model_key):
+    """Load an int8 CTranslate2 translator (int8_float16 on the GPU), converting the checkpoint on first use."""
+    model_dir = os.path.join(CT2_MODEL_DIR, model_key)
+    # Convert the checkpoint once; later runs reuse the converted model on disk
+    if not os.path.isdir(model_dir):
+        converter = ctranslate2.converters.TransformersConverter(model_name)
+        converter.convert(model_dir, quantization="int8")
+    # int8 weights with fp16 activations on the GPU, plain int8 on the CPU
+    compute_type = "int8_float16" if DEVICE == "cuda" else "int8"
+    # One replica per inference worker so concurrent batches don't queue on a single translator,
+    # with the cores left to the bot split between them
+    return ctranslate2.Translator(
+        model_dir,
+        device=DEVICE,
+        compute_type=compute_type,
+        inter_threads=INFERENCE_WORKERS,
+        intra_threads=max(1, (os.cpu_count() - 2) // INFERENCE_WORKERS),
+    )
+
+def load_onnxruntime_model(model_name, model_key):
+    """
+    Load an ONNX Runtime model, exporting it on first use. On the CPU the graphs are dynamically
+    quantized to int8 unless CPU_PRECISION asks otherwise; on the GPU the fp32 export runs on the
+    CUDA execution provider instead (when onnxruntime-gpu is installed), since the int8 dynamic
+    quantization ops have no CUDA kernels.
+    """
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    export_dir = os.path.join(ONNX_MODEL_DIR, f"{model_key}-fp32")
+    model_dir = os.path.join(ONNX_MODEL_DIR, model_key)
+    onnx_files = ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx")
+
+    # Export the encoder/decoder graphs once
+    if not os.path.isdir(export_dir):
+        ort_model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_merged=False)
+        ort_model.save_pretrained(export_dir)
+
+    session_options = onnxruntime.SessionOptions()
+    session_options.intra_op_num_threads = max(1, os.cpu_count() // 2)
+    # Apply every graph fusion (attention, LayerNorm, GELU) when the sessions are created
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    if DEVICE == "cuda":
+        # The CUDA provider only ships with the onnxruntime-gpu wheel; with the CPU wheel
+        # installed, fall through to the CPU graphs instead of failing every load
+        if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            return ORTModelForSeq2SeqLM.from_pretrained(
+                export_dir, provider="CUDAExecutionProvider", session_options=session_options
+            )
+        print(f"CUDAExecutionProvider unavailable, running {model_name} on the CPU.")
+    if CPU_PRECISION != "int8":
+        # CPUs without VNNI can run the dynamically quantized graphs slower than fp32
+        return ORTModelForSeq2SeqLM.from_pretrained(
+            export_dir, provider="CPUExecutionProvider", session_options=session_options
+        )
+
+    # Quantize the exported graphs once
+    if not os.path.isdir(model_dir):
+        quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        for file_name in onnx_files:
+            quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=file_name)
+            quantizer.quantize(save_dir=model_dir, quantization_config=quantization_config)
+
+    encoder_file, decoder_file, decoder_with_past_file = (
+        file_name.replace(".onnx", "_quantized.onnx") for file_name in onnx_files
+    )
+    return ORTModelForSeq2SeqLM.from_pretrained(
+        model_dir,
+        encoder_file_name=encoder_file,
+        decoder_file_name=decoder_file,
+        decoder_with_past_file_name=decoder_with_past_file,
+        provider="CPUExecutionProvider",
+        session_options=session_options,
+    )
+
+def load_transformers_model(model_name, model_key):
+    """
+    Load the PyTorch MarianMT model on DEVICE in eval mode with torch.compile. With CPU_PRECISION=int8
+    the CPU model's Linear layers are dynamically quantized; otherwise the encoder uses BetterTransformer.
+    """
+    from optimum.bettertransformer import BetterTransformer
+
+    # Load the weights straight into DTYPE instead of materializing them in fp32 first, memory mapping
+    # safetensors checkpoints instead of building a randomly initialized model and copying into it
+    model = from_pretrained_offline_first(MarianMTModel, model_name, torch_dtype=DTYPE, low_cpu_mem_usage=True)
+    model = model.to(DEVICE).eval()
+    if DEVICE == "cpu" and CPU_PRECISION == "int8":
+        # int8 weights halve the memory traffic of the decoder matmuls; BetterTransformer
+        # fuses the fp32 encoder weights and can't take quantized Linear layers, so it is skipped
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        try:
+            model = BetterTransformer.transform(model)
+        except (NotImplementedError, ValueError) as e:
+            print(f"BetterTransformer unavailable for {model_name}, using eager attention: {e}")
+
+    # Compile the forward pass that generate() calls on every decoder step.
+    # CUDA graphs ("reduce-overhead") only help on the GPU, the CPU uses the default inductor mode
+    compile_mode = "reduce-overhead" if DEVICE == "cuda" else "default"
+    eager_forward = model.forward
+    try:
+        model.forward = torch.compile(eager_forward, mode=compile_mode, dynamic=True, fullgraph=False)
+        # torch.compile is lazy and only fails on the first call, so pay the compile cost here
+        # with a short decode of a lone end-of-sentence token, where a failure can still fall back
+        warmup_ids = torch.tensor([[model.config.eos_token_id]], device=DEVICE)
+        with torch.inference_mode():
+            model.generate(
+                input_ids=warmup_ids,
+                attention_mask=torch.ones_like(warmup_ids),
+                max_new_tokens=2,
+                num_beams=NUM_BEAMS,
+            )
+    except Exception as e:
+        model.forward = eager_forward
+        print(f"torch.compile unavailable for {model_name}, running eagerly: {e}")
+    return model
+
+def load_tokenizer(model_name):
+    """Load the Rust-backed fast tokenizer when one is available, else the SentencePiece MarianTokenizer."""
+    try:
+        return from_pretrained_offline_first(AutoTokenizer, model_name, use_fast=True)
+    except ValueError as e:
+        print(f"Fast tokenizer unavailable for {model_name}, using MarianTokenizer: {e}")
+        return from_pretrained_offline_first(MarianTokenizer, model_name)
+
+MODEL_LOADERS = {
+    "ctranslate2": load_ctranslate2_model,
+    "onnxruntime": load_onnxruntime_model,
+    "transformers": load_transformers_model,
+}
+
+def load_model_and_tokenizer(source_lang, target_lang):
+    """Load the model and tokenizer for a language pair. Blocking, run it in a worker thread."""
+    model_key = f"{source_lang}-{target_lang}"
+    model_name = f"Helsinki-NLP/opus-mt-{source_lang}-{target_lang}"
+    try:
+        tokenizer = tokenizer_cache.get(model_key)
+        if tokenizer is None:
+            tokenizer = load_tokenizer(model_name)
+            tokenizer_cache[model_key] = tokenizer
+        model = MODEL_LOADERS[TRANSLATION_BACKEND](model_name, model_key)
+        if TRANSLATION_BACKEND != "ctranslate2":
+            # Bake the shared decoding settings into the generation config once, overriding the
+            # checkpoint's beam search defaults, so generate() only gets the per-batch length cap
+            model.generation_config.update(**GEN_KW)
+        print(f"Loaded model for {source_lang} -> {target_lang}.")
+        return model, tokenizer
+    except Exception as e:
+        print(f"Error loading model {model_name}: {e}")
+        return None, None
+
+async def get_model_and_tokenizer(source_lang, target_lang):
+    """Retrieve the model and tokenizer from the cache or load them if not cached."""
+    model_key = f"{source_lang}-{target_lang}"
+
+    # Unknown codes (e.g. an unsupported detected language) would only 404 on the Hub
+    if source_lang not in SUPPORTED_LANGUAGES or target_lang not in SUPPORTED_LANGUAGES:
+        return None, None
+
+    # One load per pair at a time, so simultaneous messages don't download the same model twice
+    async with load_locks[model_key]:
+        if model_key in model_cache:
+            model_cache.move_to_end(model_key)
+            return model_cache[model_key]
+
+        # Downloading and initializing a model can take seconds, keep it off the event loop
+        model, tokenizer = await run_in_inference_thread(load_model_and_tokenizer, source_lang, target_lang)
+        if model is None or tokenizer is None:
+            return None, None
+        model_cache[model_key] = (model, tokenizer)
+
+        # Evict the least recently used models to bound memory
+        while len(model_cache) > MAX_CACHED_MODELS:
+            evicted_key, _ = model_cache.popitem(last=False)
+            print(f"Evicted cached model for {evicted_key}.")
+            gc.collect()
+            if DEVICE == "cuda":
+                torch.cuda.empty_cache()
+        return model, tokenizer
+
+async def run_in_inference_thread(func, *args):
+    """Run a blocking model call on the inference executor without stalling the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, func, *args)
+
+def max_output_length(input_length):
+    """Cap the decoded length relative to the input so short chat lines stop early."""
+    return min(256, int(input_length * 1.5) + 16)
+
+def get_input_buffers():
+    """Take a free (input_ids, attention_mask) buffer pair from the pool, allocating one if empty."""
+    try:
+        return input_buffers.get_nowait()
+    except queue.Empty:
+        size = BUFFER_BATCH_SIZE * MAX_INPUT_LENGTH
+        # Page-locked host memory lets the copy to the GPU run asynchronously
+        pin_memory = DEVICE == "cuda"
+        return (
+            torch.empty(size, dtype=torch.long, pin_memory=pin_memory),
+            torch.empty(size, dtype=torch.long, pin_memory=pin_memory),
+        )
+
+def release_input_buffers(buffers):
+    """Return a buffer pair to the pool."""
+    input_buffers.put(buffers)
+
+def beam_search_kwargs(num_beams):
+    """Stop beams once enough hypotheses finish and apply the length penalty, for beam search only."""
+    if num_beams > 1:
+        return dict(early_stopping=True, length_penalty=BEAM_LENGTH_PENALTY)
+    return {}
+
+def generate_chunk(model, tokenizer, token_ids, num_beams=NUM_BEAMS):
+    """Pad up to BUFFER_BATCH_SIZE tokenized texts into pooled buffers and decode them in one generate call."""
+    batch_size, seq_len = len(token_ids), max(len(ids) for ids in token_ids)
+    # Fill contiguous views of pooled buffers instead of allocating new tensors per batch
+    buffers = get_input_buffers()
+    ids_buffer, mask_buffer = buffers
+    input_ids = ids_buffer[:batch_size * seq_len].view(batch_size, seq_len)
+    attention_mask = mask_buffer[:batch_size * seq_len].view(batch_size, seq_len)
+    input_ids.fill_(tokenizer.pad_token_id)
+    attention_mask.zero_()
+    for row, ids in enumerate(token_ids):
+        input_ids[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, :len(ids)] = 1
+
+    # The PyTorch and CUDA ONNX Runtime models expect their inputs on their device; the pooled buffers
+    # are pinned, so the copies are queued on the stream instead of blocking this thread.
+    # generate() synchronizes on its stopping checks, so the buffers are free again by the time they are released
+    if model.device.type == "cuda":
+        input_ids = input_ids.to(model.device, non_blocking=True)
+        attention_mask = attention_mask.to(model.device, non_blocking=True)
+
+    try:
+        with torch.inference_mode():
+            translated = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_output_length(seq_len),
+                num_beams=num_beams,
+                **beam_search_kwargs(num_beams),
+            )
+    finally:
+        release_input_buffers(buffers)
+    return tokenizer.batch_decode(translated, skip_special_tokens=True)
+
+def generate_translations(model, tokenizer, texts, num_beams=NUM_BEAMS):
+    """Translate a batch of texts with the loaded model and its Marian tokenizer."""
+    if TRANSLATION_BACKEND == "ctranslate2":
+        # Tokenize the whole batch in one call; CTranslate2 only needs the subword strings
+        token_ids = tokenizer(texts, truncation=True, max_length=MAX_INPUT_LENGTH, return_attention_mask=False)["input_ids"]
+        source_tokens = [tokenizer.convert_ids_to_tokens(ids) for ids in token_ids]
+        max_length = max_output_length(max(len(tokens) for tokens in source_tokens))
+        # CTranslate2 sorts the inputs by length and splits them into chunks of max_batch_size itself.
+        # Its beam search already stops once beam_size hypotheses are finished, so only the length penalty is passed
+        length_penalty = BEAM_LENGTH_PENALTY if num_beams > 1 else 1
+        results = model.translate_batch(
+            source_tokens,
+            beam_size=num_beams,
+            length_penalty=length_penalty,
+            max_decoding_length=max_length,
+            max_batch_size=BUFFER_BATCH_SIZE,
+        )
+        return [
+            tokenizer.decode(tokenizer.convert_tokens_to_ids(result.hypotheses[0]), skip_special_tokens=True)
+            for result in results
+        ]
+
+    # ONNX Runtime models expose the same generate() API as MarianMTModel.
+    # Decode texts of similar length together, in chunks that fit a pooled buffer,
+    # so one long message doesn't pad every short one in the batch
+    # The attention masks are built in the pooled buffers, so the tokenizer only returns the ids
+    token_ids = tokenizer(texts, truncation=True, max_length=MAX_INPUT_LENGTH, return_attention_mask=False)["input_ids"]
+    order = sorted(range(len(texts)), key=lambda i: len(token_ids[i]))
+    translations = [None] * len(texts)
+    for start in range(0, len(order), BUFFER_BATCH_SIZE):
+        chunk = order[start:start + BUFFER_BATCH_SIZE]
+        for i, translation in zip(chunk, generate_chunk(model, tokenizer, [token_ids[i] for i in chunk], num_beams)):
+            translations[i] = translation
+    return translations
+
+async def translate_batch(source_lang, target_lang, texts, num_beams=NUM_BEAMS):
+    """Translate a batch of texts for a language pair, decoding in a worker thread."""
+    model, tokenizer = await get_model_and_tokenizer(source_lang, target_lang)
+    if model is None or tokenizer is None:
+        raise RuntimeError(f"Translation model for {source_lang} -> {target_lang} could not be loaded or is unsupported.")
+    # Decode off the event loop so other requests keep being served
+    return await run_in_inference_thread(generate_translations, model, tokenizer, texts, num_beams)
+
+async def preload_models():
+    """Load the PRELOAD_PAIRS models and run one dummy translation each to warm them up."""
+    preloaded = 0
+    for source_lang, target_lang in PRELOAD_PAIRS:
+        # A pair that fails to warm up is loaded again on first use, it shouldn't stop the others
+        try:
+            model, tokenizer = await get_model_and_tokenizer(source_lang, target_lang)
+            if model is None or tokenizer is None:
+                continue
+            # The first decode primes the kernels and allocator, keep it out of user requests
+            await run_in_inference_thread(generate_translations, model, tokenizer, ["hi"])
+            preloaded += 1
+        except Exception as e:
+            print(f"Error preloading {source_lang} -> {target_lang}: {e}")
+    print(f"Preloaded {preloaded} of {len(PRELOAD_PAIRS)} language pairs.")
@@ -0,0 +1,45 @@
+"""
+Language and decoding settings for vioLa. Kept free of the inference runtime, so the bot can
+import them without loading torch when translation runs in inference_server.py.
+"""
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Beam width for every backend; greedy search (1) keeps live chat latency low
+NUM_BEAMS = int(os.getenv('NUM_BEAMS', '1'))
+# Beam width for translations explicitly asked to favour quality over speed (!tquality)
+QUALITY_NUM_BEAMS = int(os.getenv('QUALITY_NUM_BEAMS', '4'))
+# Length penalty for beam search; below 1 it stops beams favouring needlessly long hypotheses
+BEAM_LENGTH_PENALTY = float(os.getenv('BEAM_LENGTH_PENALTY', '0.6'))
+
+# List of supported language codes and their respective languages for MarianMT
+LANGUAGE_CODES = {
+    "en": "English",
+    "fr": "French",
+    "de": "German",
+    "es": "Spanish",
+    "it": "Italian",
+    "ru": "Russian",
+    "zh": "Chinese (Simplified)",
+    "ja": "Japanese",
+    "ko": "Korean",
+    "ar": "Arabic",
+    "pt": "Portuguese",
+    "nl": "Dutch",
+    "sv": "Swedish",
+    "pl": "Polish",
+    "fi": "Finnish",
+    "tr": "Turkish",
+    "cs": "Czech",
+    "hu": "Hungarian",
+    "ro": "Romanian",
+    "tl": "Tagalog",
+    "th": "Thai",
+    "id": "Indonesian",
+    "hi": "Hindi",
+}
+
+SUPPORTED_LANGUAGES = frozenset(LANGUAGE_CODES)